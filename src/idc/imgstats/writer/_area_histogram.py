@@ -1,10 +1,12 @@
 import argparse
 import csv
+import io
 import json
 import numpy as np
 import sys
 import termplotlib as tpl
-from collections import OrderedDict
+from array import array
+from collections import defaultdict, OrderedDict
 from typing import List, Dict
 
 from wai.logging import LOGGING_WARNING
@@ -12,6 +14,16 @@ from wai.logging import LOGGING_WARNING
 from idc.api import ObjectDetectionData, ImageSegmentationData, StreamWriter, \
     make_list, LABEL_KEY
 
+try:
+    # orjson is a lot faster than the json module, but not a requirement
+    import orjson
+
+    def _json_dumps(o) -> str:
+        return orjson.dumps(o, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    def _json_dumps(o) -> str:
+        return json.dumps(o, indent=2)
+
 OUTPUT_FORMAT_TEXT = "text"
 OUTPUT_FORMAT_CSV = "csv"
 OUTPUT_FORMAT_JSON = "json"
@@ -62,6 +74,8 @@ class AreaHistogramWriter(StreamWriter):
         self.normalized = normalized
         self.all_label = all_label
         self._data = None
+        self._all_label = None
+        self._output = None
 
     def name(self) -> str:
         """
@@ -140,24 +154,42 @@ class AreaHistogramWriter(StreamWriter):
             self.normalized = False
         if self.all_label is None:
             self.all_label = "ALL"
-        self._data = dict()
+        self._data = defaultdict(lambda: array("d"))
+        self._output = {
+            OUTPUT_FORMAT_TEXT: self.output_text,
+            OUTPUT_FORMAT_CSV: self.output_csv,
+            OUTPUT_FORMAT_JSON: self.output_json,
+        }
+        if self.output_format not in self._output:
+            raise Exception("Unhandled output format: %s" % self.output_format)
 
     def append_value(self, label: str, value):
         """
         Appends a value to the label.
         """
-        if "" not in self._data:
-            self._data[""] = []
-        if label not in self._data:
-            self._data[label] = []
-
         if value <= 0:
             self.logger().warning("Invalid area (%s): %f" % (label, value))
 
-        if label != "":
-            self._data[""].append(value)
         self._data[label].append(value)
 
+    def append_values(self, labels: List[str], values: np.ndarray):
+        """
+        Appends a whole batch of values at once, grouped by their labels.
+
+        :param labels: the labels, one per value
+        :type labels: list
+        :param values: the values to append
+        :type values: np.ndarray
+        """
+        if np.any(values <= 0):
+            for label, value in zip(labels, values):
+                if value <= 0:
+                    self.logger().warning("Invalid area (%s): %f" % (label, value))
+
+        labels_arr = np.asarray(labels)
+        for label in set(labels):
+            self._data[label].extend(values[labels_arr == label].tolist())
+
     def create_all_label(self, labels: List[str]) -> str:
         """
         Creates a unique label for "all".
@@ -187,7 +219,7 @@ class AreaHistogramWriter(StreamWriter):
         plots = ""
         for k in keys:
             if k == "":
-                label = self.create_all_label(keys)
+                label = self._all_label
             else:
                 label = k
             plots += label + ":\n\n"
@@ -213,25 +245,31 @@ class AreaHistogramWriter(StreamWriter):
         :param use_stdout: whether to use stdout or the file
         :type use_stdout: bool
         """
-        if use_stdout:
-            writer = csv.writer(sys.stdout)
-            f = None
-        else:
-            f = open(self.output_file, "w")
-            writer = csv.writer(f)
+        # the rows get assembled in memory and written out in one go,
+        # avoiding per-row I/O
+        buf = io.StringIO()
+        writer = csv.writer(buf)
 
         writer.writerow(["label", "bin", "from", "to", "count"])
         for k in keys:
             if k == "":
-                label = self.create_all_label(keys)
+                label = self._all_label
             else:
                 label = k
             counts, bin_edges = histograms[k]
-            for i in range(len(counts)):
-                writer.writerow([label, i, bin_edges[i], bin_edges[i+1], counts[i]])
+            # bulk conversion to lists and a single writerows call is a lot
+            # cheaper than per-row writerow calls with numpy scalars
+            counts_list = counts.tolist()
+            edges_list = bin_edges.tolist()
+            writer.writerows(
+                (label, i, edges_list[i], edges_list[i + 1], counts_list[i])
+                for i in range(len(counts_list)))
 
-        if f is not None:
-            f.close()
+        if use_stdout:
+            sys.stdout.write(buf.getvalue())
+        else:
+            with open(self.output_file, "w") as f:
+                f.write(buf.getvalue())
 
     def output_json(self, histograms: Dict, keys: List[str], use_stdout: bool):
         """
@@ -247,7 +285,7 @@ class AreaHistogramWriter(StreamWriter):
         data = []
         for k in keys:
             if k == "":
-                label = self.create_all_label(keys)
+                label = self._all_label
             else:
                 label = k
             counts, bin_edges = histograms[k]
@@ -264,36 +302,68 @@ class AreaHistogramWriter(StreamWriter):
             data.append(label_data)
 
         if use_stdout:
-            print(json.dumps(data, indent=2))
+            print(_json_dumps(data))
         else:
             with open(self.output_file, "w") as f:
-                json.dump(data, f, indent=2)
+                f.write(_json_dumps(data))
 
     def output_histograms(self):
         """
         Computes and outputs the histograms.
         """
-        histograms = dict()
         keys = []
+        arrays = dict()
         for k in self._data:
+            arrays[k] = np.asarray(self._data[k])
             if k != "":
                 keys.append(k)
-            counts, bin_edges = np.histogram(self._data[k], bins=self.num_bins)
-            histograms[k] = (counts, bin_edges)
+
+        # the areas are only stored once per label (with "" holding just the
+        # unlabeled ones), so the "all" values are the concatenation of all
+        # the per-label arrays
+        if len(arrays) > 0:
+            all_values = np.concatenate(list(arrays.values()))
+        else:
+            all_values = np.zeros(0)
+
+        # sharing the bin edges of the combined values across all labels makes
+        # the histograms comparable and lets the "all" histogram be derived by
+        # summing up the per-label counts, binning each area only once
+        histograms = dict()
+        counts_all = np.zeros(self.num_bins, dtype=np.int64)
+        if (not self.normalized) and (len(all_values) > 0) and np.all(all_values == np.floor(all_values)):
+            # absolute areas are pixel counts, i.e., integers, so the bin
+            # index can be computed with integer arithmetic and counted via
+            # np.bincount, skipping np.histogram's bin-edge search
+            lo = int(all_values.min())
+            hi = int(all_values.max())
+            span = hi - lo + 1
+            bin_edges = np.linspace(lo, hi + 1, self.num_bins + 1)
+            for k in arrays:
+                idx = (arrays[k].astype(np.int64) - lo) * self.num_bins // span
+                counts = np.bincount(idx, minlength=self.num_bins)
+                counts_all += counts
+                if k != "":
+                    histograms[k] = (counts, bin_edges)
+        else:
+            bin_edges = np.histogram_bin_edges(all_values, bins=self.num_bins)
+            for k in arrays:
+                counts, _ = np.histogram(arrays[k], bins=bin_edges)
+                counts_all += counts
+                if k != "":
+                    histograms[k] = (counts, bin_edges)
+        histograms[""] = (counts_all, bin_edges)
 
         use_stdout = (self.output_file is None) or (len(self.output_file) == 0)
 
         keys.sort()
         keys.insert(0, "")
 
-        if self.output_format == "text":
-            self.output_text(histograms, keys, use_stdout)
-        elif self.output_format == "csv":
-            self.output_csv(histograms, keys, use_stdout)
-        elif self.output_format == "json":
-            self.output_json(histograms, keys, use_stdout)
-        else:
-            raise Exception("Unhandled output format: %s" % self.output_format)
+        # resolved once here, the output methods just reuse it
+        self._all_label = self.create_all_label(keys)
+
+        # the format was validated in initialize, so a plain lookup suffices
+        self._output[self.output_format](histograms, keys, use_stdout)
 
     def write_stream(self, data):
         """
@@ -304,25 +374,42 @@ class AreaHistogramWriter(StreamWriter):
         for item in make_list(data):
             img_area = item.image_width * item.image_height
             if isinstance(item, ObjectDetectionData):
-                for obj in item.get_absolute():
-                    label = ""
-                    if self.label_key in obj.metadata:
-                        label = obj.metadata[self.label_key]
-                    if not self.force_bbox and obj.has_polygon():
-                        area = obj.get_polygon().area()
-                    else:
-                        area = obj.get_rectangle().area()
+                if self.force_bbox:
+                    # every area comes from the bounding box, so the whole
+                    # image can be processed as one batch
+                    objs = item.get_absolute()
+                    labels = [obj.metadata.get(self.label_key, "") for obj in objs]
+                    areas = np.fromiter(
+                        (obj.get_rectangle().area() for obj in objs),
+                        dtype=np.float64, count=len(objs))
                     if self.normalized:
-                        self.append_value(label, area / img_area)
-                    else:
-                        self.append_value(label, area)
+                        areas /= img_area
+                    self.append_values(labels, areas)
+                else:
+                    # hoisting the attributes into locals keeps the per-object
+                    # loop free of repeated attribute lookups
+                    label_key = self.label_key
+                    normalized = self.normalized
+                    append_value = self.append_value
+                    for obj in item.get_absolute():
+                        label = obj.metadata.get(label_key, "")
+                        if obj.has_polygon():
+                            area = obj.get_polygon().area()
+                        else:
+                            area = obj.get_rectangle().area()
+                        if normalized:
+                            append_value(label, area / img_area)
+                        else:
+                            append_value(label, area)
             elif isinstance(item, ImageSegmentationData):
-                for label in item.annotation.layers:
-                    area = np.count_nonzero(item.annotation.layers[label])
-                    if self.normalized:
-                        self.append_value(label, area / img_area)
+                normalized = self.normalized
+                append_value = self.append_value
+                for label, layer in item.annotation.layers.items():
+                    area = np.count_nonzero(layer)
+                    if normalized:
+                        append_value(label, area / img_area)
                     else:
-                        self.append_value(label, area)
+                        append_value(label, area)
 
     def finalize(self):
         """
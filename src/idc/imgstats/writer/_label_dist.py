@@ -1,8 +1,9 @@
 import argparse
 import csv
+import io
 import json
 import sys
-from collections import OrderedDict
+from collections import Counter
 from typing import List, Dict
 
 from wai.logging import LOGGING_WARNING
@@ -10,6 +11,16 @@ from wai.logging import LOGGING_WARNING
 from idc.api import ImageClassificationData, ObjectDetectionData, ImageSegmentationData, StreamWriter, \
     make_list, LABEL_KEY
 
+try:
+    # orjson is a lot faster than the json module, but not a requirement
+    import orjson
+
+    def _json_dumps(o) -> str:
+        return orjson.dumps(o, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    def _json_dumps(o) -> str:
+        return json.dumps(o, indent=2)
+
 OUTPUT_FORMAT_TEXT = "text"
 OUTPUT_FORMAT_CSV = "csv"
 OUTPUT_FORMAT_JSON = "json"
@@ -50,6 +61,7 @@ class LabelDistributionWriter(StreamWriter):
         self.label_key = label_key
         self.percentages = percentages
         self._labels = None
+        self._handlers = None
 
     def name(self) -> str:
         """
@@ -116,16 +128,51 @@ class LabelDistributionWriter(StreamWriter):
             self.label_key = LABEL_KEY
         if self.percentages is None:
             self.percentages = False
-        self._labels = dict()
+        self._labels = Counter()
+        self._handlers = {
+            ImageClassificationData: self._append_image_classification,
+            ObjectDetectionData: self._append_object_detection,
+            ImageSegmentationData: self._append_image_segmentation,
+        }
 
     def add_label(self, label: str):
         """
         Increments the count for the label.
         """
-        if label not in self._labels:
-            self._labels[label] = 0
+        self._labels[label] += 1
+
+    def _append_image_classification(self, item: ImageClassificationData):
+        """
+        Counts the label of an image classification record.
 
-        self._labels[label] = self._labels[label] + 1
+        :param item: the record to process
+        :type item: ImageClassificationData
+        """
+        self.add_label(item.annotation.label)
+
+    def _append_object_detection(self, item: ObjectDetectionData):
+        """
+        Counts the labels of all objects in an object detection record.
+
+        :param item: the record to process
+        :type item: ObjectDetectionData
+        """
+        # Counter.update counts the whole batch in C
+        self._labels.update(
+            obj.metadata[self.label_key]
+            for obj in item.annotation
+            if self.label_key in obj.metadata)
+
+    def _append_image_segmentation(self, item: ImageSegmentationData):
+        """
+        Counts the layer labels of an image segmentation record.
+
+        :param item: the record to process
+        :type item: ImageSegmentationData
+        """
+        # just the layer names get counted; passing the dict itself would make
+        # Counter.update treat it as a label->count mapping
+        self._labels.update(item.annotation.layers.keys())
 
     def output_text(self, dist: Dict, keys: List, use_stdout: bool):
         """
@@ -138,20 +185,16 @@ class LabelDistributionWriter(StreamWriter):
         :param use_stdout: whether to use stdout or the file
         :type use_stdout: bool
         """
+        if self.percentages:
+            lines = [f"{k}: {dist[k]:f}\n" for k in keys]
+        else:
+            lines = [f"{k}: {dist[k]:d}\n" for k in keys]
+
         if use_stdout:
-            for k in keys:
-                if self.percentages:
-                    print("%s: %f" % (k, dist[k]))
-                else:
-                    print("%s: %d" % (k, dist[k]))
+            sys.stdout.writelines(lines)
         else:
-            with open(self.output_file, "w") as f:
-                for k in keys:
-                    if self.percentages:
-                        f.write("%s: %f" % (k, dist[k]))
-                    else:
-                        f.write("%s: %d" % (k, dist[k]))
-                    f.write("\n")
+            with open(self.output_file, "w", buffering=1 << 16) as f:
+                f.writelines(lines)
 
     def output_csv(self, dist: Dict, keys: List, use_stdout: bool):
         """
@@ -164,51 +207,56 @@ class LabelDistributionWriter(StreamWriter):
         :param use_stdout: whether to use stdout or the file
         :type use_stdout: bool
         """
-        if use_stdout:
-            writer = csv.writer(sys.stdout)
-            f = None
-        else:
-            f = open(self.output_file, "w")
-            writer = csv.writer(f)
-
+        # the rows get assembled in memory and written out in one go,
+        # avoiding per-row I/O
+        buf = io.StringIO()
+        writer = csv.writer(buf)
         writer.writerow(["Label", "Percent" if self.percentages else "Count"])
-        for k in keys:
-            writer.writerow([k, dist[k]])
+        writer.writerows((k, dist[k]) for k in keys)
 
-        if f is not None:
-            f.close()
+        if use_stdout:
+            sys.stdout.write(buf.getvalue())
+        else:
+            with open(self.output_file, "w") as f:
+                f.write(buf.getvalue())
 
-    def output_json(self, dist: Dict, use_stdout: bool):
+    def output_json(self, dist: Dict, keys: List, use_stdout: bool):
         """
         Outputs the label distribution in json format.
 
         :param dist: the distribution dictionary
         :type dist: dict
+        :param keys: they sorted keys
+        :type keys: list
         :param use_stdout: whether to use stdout or the file
         :type use_stdout: bool
         """
+        data = {k: dist[k] for k in keys}
         if use_stdout:
-            print(json.dumps(dist, indent=2))
+            print(_json_dumps(data))
         else:
             with open(self.output_file, "w") as f:
-                json.dump(dist, f, indent=2)
+                f.write(_json_dumps(data))
 
     def output_label_distribution(self):
         """
         Outputs the distribution.
         """
-        keys = list(self._labels.keys())
-        keys.sort()
-        dist = OrderedDict()
-        for k in keys:
-            dist[k] = self._labels[k]
+        keys = sorted(self._labels)
 
         if self.percentages:
-            total = 0
-            for k in dist:
-                total += dist[k]
-            for k in dist:
-                dist[k] = dist[k] / total * 100.0
+            # an empty stream (or one where no object carried the label key)
+            # produces a zero total, in which case there is nothing to scale
+            total = sum(self._labels.values())
+            if total > 0:
+                factor = 100.0 / total
+                dist = {k: self._labels[k] * factor for k in keys}
+            else:
+                dist = dict()
+        else:
+            # the output methods only look up dist[k] along the sorted keys,
+            # so the counter can be passed through without copying it
+            dist = self._labels
 
         use_stdout = (self.output_file is None) or (len(self.output_file) == 0)
 
@@ -217,7 +265,7 @@ class LabelDistributionWriter(StreamWriter):
         elif self.output_format == OUTPUT_FORMAT_CSV:
             self.output_csv(dist, keys, use_stdout)
         elif self.output_format == OUTPUT_FORMAT_JSON:
-            self.output_json(dist, use_stdout)
+            self.output_json(dist, keys, use_stdout)
         else:
             raise Exception("Unhandled output format: %s" % self.output_format)
 
@@ -228,15 +276,17 @@ class LabelDistributionWriter(StreamWriter):
         :param data: the data to write (single record or iterable of records)
         """
         for item in make_list(data):
-            if isinstance(item, ImageClassificationData):
-                self.add_label(item.annotation.label)
-            elif isinstance(item, ObjectDetectionData):
-                for obj in item.annotation:
-                    if self.label_key in obj.metadata:
-                        self.add_label(obj.metadata[self.label_key])
-            elif isinstance(item, ImageSegmentationData):
-                for label in item.annotation.layers:
-                    self.add_label(label)
+            handler = self._handlers.get(type(item))
+            if handler is None:
+                # subclasses get resolved via isinstance once and are then
+                # cached for the fast type lookup
+                for cls in (ImageClassificationData, ObjectDetectionData, ImageSegmentationData):
+                    if isinstance(item, cls):
+                        handler = self._handlers[cls]
+                        self._handlers[type(item)] = handler
+                        break
+            if handler is not None:
+                handler(item)
 
     def finalize(self):
         """